@@ -1,22 +1,25 @@
+import io
 import os
 import sys
 import json
-import base64
-import argparse
-from dataclasses import dataclass, field
-from typing import List, Dict, Any
+import mmap
+import stat
+from types import SimpleNamespace
+from typing import List, Dict, Any, Optional
 
-# Optional imports
+import msgspec
+
+# Optional imports (openai and jinja2 are imported lazily, on first use)
 try:
-    import openai
+    import orjson
 except Exception:
-    openai = None
+    orjson = None
 
+# SIMD base64 when available; same b64encode API as the stdlib module.
 try:
-    from jinja2 import Environment, BaseLoader
+    import pybase64 as b64
 except Exception:
-    Environment = None
-    BaseLoader = None
+    import base64 as b64
 
 # -----------------------------
 # Simple utilities
@@ -26,34 +29,101 @@ ANSI = {
     "red": "\u001b[31m",
     "green": "\u001b[32m",
     "yellow": "\u001b[33m",
-    "blue": "\u001b[34m",
     "cyan": "\u001b[36m",
 }
 
 
-def color(text: str, col: str) -> str:
-    code = ANSI.get(col, "")
-    return f"{code}{text}{ANSI['reset']}" if code else text
+def _colorizer(col: str):
+    prefix, reset = ANSI[col], ANSI["reset"]
+
+    def colorize(text: str) -> str:
+        return f"{prefix}{text}{reset}"
+    return colorize
+
+
+# Colour helpers bound at import, for the CLI output paths.
+c_red = _colorizer("red")
+c_green = _colorizer("green")
+c_yellow = _colorizer("yellow")
+c_cyan = _colorizer("cyan")
 
 
 def print_json(obj: Any):
-    print(json.dumps(obj, indent=2, ensure_ascii=False))
+    out = getattr(sys.stdout, "buffer", None)
+    if out is None:
+        print(dump_json(obj))
+        return
+    # Write the encoded bytes directly; flush pending text first to keep ordering.
+    sys.stdout.flush()
+    out.write(dump_json_bytes(obj) + b"\n")
+
+
+def dump_json_bytes(obj: Any, indent: bool = True) -> bytes:
+    """
+    Serialize to UTF-8 JSON. A Resume is encoded by msgspec from its schema;
+    other data uses orjson when available, otherwise the stdlib json module.
+    """
+    if isinstance(obj, Resume):
+        data = msgspec.json.encode(obj)
+        return msgspec.json.format(data, indent=2) if indent else data
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode("utf-8")
+
+
+def dump_json(obj: Any, indent: bool = True) -> str:
+    return dump_json_bytes(obj, indent).decode("utf-8")
+
+
+def load_json_bytes(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def drop_nulls(obj: Any) -> Any:
+    # JSON nulls (common in AI output for missing values) are removed, so the
+    # field falls back to its default instead of failing type validation.
+    if isinstance(obj, dict):
+        return {k: drop_nulls(v) for k, v in obj.items() if v is not None}
+    if isinstance(obj, list):
+        return [drop_nulls(v) for v in obj if v is not None]
+    return obj
+
+
+def parse_ai_json(raw: str) -> Any:
+    """
+    Parses JSON from a model answer, dropping a surrounding ```json fence if present.
+    Tries orjson first; stdlib json is the fallback for non-strict output
+    such as NaN/Infinity. Raises ValueError if neither can parse it.
+    """
+    text = raw.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
 
 # -----------------------------
 # Resume Data Model
 # -----------------------------
-@dataclass
-class Resume:
+class Resume(msgspec.Struct, dict=True):
+    # dict=True lets instances carry non-field attributes such as the
+    # cached photo data URI; only the fields below are (de)serialized.
     name: str = ""
     title: str = ""
     summary: str = ""
-    experience: List[Dict[str, Any]] = field(default_factory=list)
-    projects: List[Dict[str, Any]] = field(default_factory=list)
-    education: List[Dict[str, Any]] = field(default_factory=list)
-    skills: List[str] = field(default_factory=list)
-    languages: List[str] = field(default_factory=list)
-    hobbies: List[str] = field(default_factory=list)
-    contact: Dict[str, str] = field(default_factory=dict)
+    experience: List[Dict[str, Any]] = msgspec.field(default_factory=list)
+    projects: List[Dict[str, Any]] = msgspec.field(default_factory=list)
+    education: List[Dict[str, Any]] = msgspec.field(default_factory=list)
+    skills: List[str] = msgspec.field(default_factory=list)
+    languages: List[str] = msgspec.field(default_factory=list)
+    hobbies: List[str] = msgspec.field(default_factory=list)
+    contact: Dict[str, str] = msgspec.field(default_factory=dict)
     photo_base64: str = ""   # base64 encoded image
     theme: str = "premium"   # premium, minimal, creative, sidebar
     sidebar_color: str = "teal"  # green, teal, mono
@@ -74,38 +144,48 @@ class Resume:
                 setattr(self, key, value)
 
     def set_photo(self, file_bytes: bytes):
-        self.photo_base64 = base64.b64encode(file_bytes).decode("utf-8")
+        self.photo_base64 = b64.b64encode(file_bytes).decode("ascii")
+
+    def set_photo_path(self, path: str):
+        # mmap the image so the encoder reads the file pages directly,
+        # without first copying the whole file into a bytes object. Pipes and
+        # other non-regular files (and empty files) cannot be mapped; read those.
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                self.set_photo(f.read())
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                self.set_photo(m)
 
     def has_photo(self):
         return bool(self.photo_base64)
 
+    @property
+    def photo_data_uri(self) -> str:
+        # Cached together with the base64 string it was built from, so templates
+        # substitute one ready-made string; rebuilt if photo_base64 changes.
+        cached = getattr(self, "_photo_data_uri", None)
+        if cached is None or cached[0] is not self.photo_base64:
+            cached = (self.photo_base64, f"data:image/jpeg;base64,{self.photo_base64}")
+            self._photo_data_uri = cached
+        return cached[1]
+
     def to_dict(self):
-        return {
-            "name": self.name,
-            "title": self.title,
-            "summary": self.summary,
-            "experience": self.experience,
-            "projects": self.projects,
-            "education": self.education,
-            "skills": self.skills,
-            "languages": self.languages,
-            "hobbies": self.hobbies,
-            "contact": self.contact,
-            "photo_base64": self.photo_base64,
-            "theme": self.theme,
-            "sidebar_color": self.sidebar_color,
-        }
+        return msgspec.structs.asdict(self)
 
     def to_json(self):
-        return json.dumps(self.to_dict(), indent=2, ensure_ascii=False)
+        return dump_json(self)
 
     @staticmethod
     def from_dict(d: Dict[str, Any]):
-        r = Resume()
-        for k, v in d.items():
-            if hasattr(r, k):
-                setattr(r, k, v)
-        return r
+        # Unknown keys and nulls are ignored; values of the wrong type raise
+        # msgspec.ValidationError.
+        return msgspec.convert(drop_nulls(d), Resume)
+
+
+# Field name -> annotated type, for checking AI-produced values before they are set.
+RESUME_FIELD_TYPES = {f.name: f.type for f in msgspec.structs.fields(Resume)}
 
 # -----------------------------
 # Templates (from the original project)
@@ -130,13 +210,35 @@ body {{
 </html>
 """
 
+# HTML_WRAPPER split around the content slot, so rendering is plain concatenation.
+_WRAPPER_HEAD, _WRAPPER_TAIL = HTML_WRAPPER.format(content="\x00", extra_css="").split("\x00")
+
+# Shared blocks, available to every theme as `macros`.
+TEMPLATE_MACROS = """
+{% macro experience(jobs, period_below=false) %}
+  {% for job in jobs %}
+    {% if period_below %}
+    <p><strong>{{ job.role }}</strong> — {{ job.company }}</p>
+    <p><em>{{ job.period }}</em></p>
+    {% else %}
+    <p><strong>{{ job.role }}</strong> — {{ job.company }} ({{ job.period }})</p>
+    {% endif %}
+    <ul>
+      {% for b in job.bullets %}
+      <li>{{ b }}</li>
+      {% endfor %}
+    </ul>
+  {% endfor %}
+{% endmacro %}
+"""
+
 TEMPLATE_PREMIUM = """
 <div style="padding:40px;">
   <h1>{{ resume.name }}</h1>
   <h3>{{ resume.title }}</h3>
 
   {% if resume.photo_base64 %}
-  <img src="data:image/jpeg;base64,{{ resume.photo_base64 }}" 
+  <img src="{{ resume.photo_data_uri }}" 
        style="width:120px;border-radius:10px;float:right;margin-top:-80px;">
   {% endif %}
 
@@ -144,14 +246,7 @@ TEMPLATE_PREMIUM = """
   <p>{{ resume.summary }}</p>
 
   <h2>Experience</h2>
-  {% for job in resume.experience %}
-    <p><strong>{{ job.role }}</strong> — {{ job.company }} ({{ job.period }})</p>
-    <ul>
-      {% for b in job.bullets %}
-      <li>{{ b }}</li>
-      {% endfor %}
-    </ul>
-  {% endfor %}
+  {{ macros.experience(resume.experience) }}
 
   <h2>Skills</h2>
   <ul>
@@ -170,15 +265,7 @@ TEMPLATE_MINIMAL = """
   <p>{{ resume.summary }}</p>
 
   <h2>Experience</h2>
-  {% for job in resume.experience %}
-    <p><strong>{{ job.role }}</strong> — {{ job.company }}</p>
-    <p><em>{{ job.period }}</em></p>
-    <ul>
-      {% for b in job.bullets %}
-      <li>{{ b }}</li>
-      {% endfor %}
-    </ul>
-  {% endfor %}
+  {{ macros.experience(resume.experience, period_below=true) }}
 </div>
 """
 
@@ -213,7 +300,7 @@ TEMPLATE_SIDEBAR = """
   <div style="width:30%;background:{{ color }};color:white;padding:30px;">
     
     {% if resume.photo_base64 %}
-    <img src="data:image/jpeg;base64,{{ resume.photo_base64 }}"
+    <img src="{{ resume.photo_data_uri }}"
          style="width:120px;height:120px;border-radius:50%;object-fit:cover;margin-bottom:20px;">
     {% endif %}
 
@@ -254,84 +341,215 @@ TEMPLATE_SIDEBAR = """
     <p>{{ resume.summary }}</p>
 
     <h2>Experience</h2>
-    {% for job in resume.experience %}
-      <p><strong>{{ job.role }}</strong> — {{ job.company }} ({{ job.period }})</p>
-      <ul>
-        {% for b in job.bullets %}
-        <li>{{ b }}</li>
-        {% endfor %}
-      </ul>
-    {% endfor %}
+    {{ macros.experience(resume.experience) }}
   </div>
 
 </div>
 """
 
 
+# Jinja environment and compiled themes, built on the first render. jinja2 is
+# only imported then, so commands that never render do not pay for it.
+# The sidebar theme is compiled once per colour, with the colour baked in.
+_ENV = None
+_COMPILED: Dict[str, Any] = {}
+_SIDEBAR_COMPILED: Dict[str, Any] = {}
+
+
+def _compiled_templates() -> Dict[str, Any]:
+    global _ENV
+    if _ENV is None:
+        try:
+            from jinja2 import Environment, BaseLoader
+        except Exception:
+            raise RuntimeError("jinja2 not installed: see requirements.txt")
+        env = Environment(loader=BaseLoader(), autoescape=False)
+        env.globals["macros"] = env.from_string(TEMPLATE_MACROS).module
+        _COMPILED.update({
+            "premium": env.from_string(TEMPLATE_PREMIUM),
+            "minimal": env.from_string(TEMPLATE_MINIMAL),
+            "creative": env.from_string(TEMPLATE_CREATIVE),
+        })
+        _SIDEBAR_COMPILED.update({
+            name: env.from_string(TEMPLATE_SIDEBAR.replace("{{ color }}", hex_))
+            for name, hex_ in SIDEBAR_COLORS.items()
+        })
+        _ENV = env
+    return _COMPILED
+
+
+def _select_template(resume: Resume):
+    compiled = _compiled_templates()
+    if resume.theme == "sidebar":
+        template = _SIDEBAR_COMPILED.get(resume.sidebar_color, _SIDEBAR_COMPILED["teal"])
+    else:
+        template = compiled.get(resume.theme)
+    if template is None:
+        raise ValueError(f"Unknown theme: {resume.theme}")
+
+    return template, {"resume": resume}
+
+
+def render_template_stream(resume: Resume, out_file):
+    """
+    Writes the rendered page to out_file chunk by chunk (Jinja streaming), so the
+    full HTML, including a large embedded photo, is never built as one string.
+    """
+    template, context = _select_template(resume)
+    out_file.write(_WRAPPER_HEAD)
+    out_file.writelines(template.stream(**context))
+    out_file.write(_WRAPPER_TAIL)
+
+
 def render_template(resume: Resume) -> str:
-    if Environment is None:
-        raise RuntimeError("jinja2 not installed: see requirements.txt")
+    # Same code path as cmd_render, collected into a string for library callers.
+    buf = io.StringIO()
+    render_template_stream(resume, buf)
+    return buf.getvalue()
 
-    env = Environment(loader=BaseLoader())
+# -----------------------------
+# AI Helpers (basic wrapper)
+# -----------------------------
 
-    if resume.theme == "premium":
-        tpl = TEMPLATE_PREMIUM
+# asyncio is imported inside the functions that need it (like jinja2 and
+# openai), so commands without AI calls do not pay for its import.
+AI_CONCURRENCY = 8  # max in-flight requests from acall_ai, to stay within rate limits
 
-    elif resume.theme == "minimal":
-        tpl = TEMPLATE_MINIMAL
+# Read once at import; the clients below are created on first use and reused,
+# which also keeps their HTTP connections alive between calls.
+_API_KEY = os.getenv("OPENAI_API_KEY")
+_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
 
-    elif resume.theme == "creative":
-        tpl = TEMPLATE_CREATIVE
+_OPENAI = None  # the openai module once imported, False if it is not installed
+_CLIENT = None
+_ASYNC_CLIENT = None
+_AI_SEMAPHORE = None
+_AI_LOOP = None
 
-    elif resume.theme == "sidebar":
-        color = SIDEBAR_COLORS.get(resume.sidebar_color, "#004d4d")
-        tpl = TEMPLATE_SIDEBAR.replace("{{ color }}", color)
 
-    else:
-        raise ValueError(f"Unknown theme: {resume.theme}")
+def _load_openai():
+    global _OPENAI
+    if _OPENAI is None:
+        try:
+            import openai
+        except Exception:
+            openai = False
+        _OPENAI = openai
+    return _OPENAI or None
 
-    template = env.from_string(tpl)
-    html = template.render(resume=resume)
 
-    return HTML_WRAPPER.format(content=html, extra_css="")
+class AIError(Exception):
+    """Raised by acall_ai when no answer could be obtained; str(e) is the "[AI ERROR] ..." message."""
+
+
+def _ai_unavailable() -> str:
+    if _load_openai() is None:
+        return "[AI ERROR] openai package not installed"
+    if not _API_KEY:
+        return "[AI ERROR] OPENAI_API_KEY not set in environment"
+    return ""
+
+
+def _ai_request(system_prompt: str, user_prompt: str, model: str = None) -> Dict[str, Any]:
+    return {
+        "model": model or _MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        "temperature": 0.2,
+    }
+
+
+def _http_options() -> Dict[str, Any]:
+    """
+    Overrides for the OpenAI SDK's default httpx clients: HTTP/2 (one
+    multiplexed connection for concurrent requests) when h2 is installed.
+    The SDK defaults (connection pool, redirects) are kept otherwise.
+    """
+    import importlib.util
+
+    return {"http2": importlib.util.find_spec("h2") is not None}
+
+
+def _ai_client():
+    global _CLIENT
+    if _CLIENT is None:
+        openai = _load_openai()
+        _CLIENT = openai.OpenAI(api_key=_API_KEY, http_client=openai.DefaultHttpxClient(**_http_options()))
+    return _CLIENT
+
+
+def _ai_async_client():
+    import asyncio
+
+    # The async connection pool and the semaphore are bound to one event loop.
+    global _ASYNC_CLIENT, _AI_SEMAPHORE, _AI_LOOP
+    loop = asyncio.get_running_loop()
+    if _AI_LOOP is not loop:
+        openai = _load_openai()
+        _ASYNC_CLIENT = openai.AsyncOpenAI(
+            api_key=_API_KEY, http_client=openai.DefaultAsyncHttpxClient(**_http_options())
+        )
+        _AI_SEMAPHORE = asyncio.Semaphore(AI_CONCURRENCY)
+        _AI_LOOP = loop
+    return _ASYNC_CLIENT, _AI_SEMAPHORE
+
+
+async def run_with_ai_client(coro):
+    """
+    Awaits coro, then closes the async OpenAI client it may have opened.
+    Use as the body of asyncio.run, since the client cannot outlive its loop.
+    """
+    global _ASYNC_CLIENT, _AI_SEMAPHORE, _AI_LOOP
+    try:
+        return await coro
+    finally:
+        if _ASYNC_CLIENT is not None:
+            await _ASYNC_CLIENT.close()
+        _ASYNC_CLIENT = _AI_SEMAPHORE = _AI_LOOP = None
 
-# -----------------------------
-# AI Helpers (basic wrapper)
-# -----------------------------
 
 def call_ai(system_prompt: str, user_prompt: str, model: str = None) -> str:
     """
     Attempts to call OpenAI. If openai package or API key not present, a clear error is returned.
     """
-    if openai is None:
-        return "[AI ERROR] openai package not installed"
-
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        return "[AI ERROR] OPENAI_API_KEY not set in environment"
+    error = _ai_unavailable()
+    if error:
+        return error
 
     try:
-        openai.api_key = api_key
-        chosen_model = model or os.getenv("OPENAI_MODEL", "gpt-4")
-
-        # Use ChatCompletion endpoint (widely supported)
-        resp = openai.ChatCompletion.create(
-            model=chosen_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.2,
-        )
-        text = resp.choices[0].message.get("content") if resp.choices else resp.choices[0].text
-        return text
+        resp = _ai_client().chat.completions.create(**_ai_request(system_prompt, user_prompt, model))
+        return resp.choices[0].message.content
 
     except Exception as e:
         return f"[AI ERROR] {e}"
 
 
-def ai_extract_resume(pdf_text: str) -> Dict[str, Any]:
-    system = """
+async def acall_ai(system_prompt: str, user_prompt: str, model: str = None) -> str:
+    """
+    Async variant of call_ai, so several requests can be awaited concurrently.
+    At most AI_CONCURRENCY requests are in flight at once. Unlike call_ai,
+    failures raise AIError so callers never mistake them for an answer.
+    """
+    error = _ai_unavailable()
+    if error:
+        raise AIError(error)
+
+    try:
+        client, semaphore = _ai_async_client()
+        async with semaphore:
+            resp = await client.chat.completions.create(**_ai_request(system_prompt, user_prompt, model))
+        return resp.choices[0].message.content
+
+    except Exception as e:
+        raise AIError(f"[AI ERROR] {e}") from e
+
+
+# Static system prompt for ai_extract_resume. It is deliberately longer than
+# 1024 tokens (rules + worked example) and never contains the PDF text, so the
+# provider can serve it from its prompt cache on repeated extractions.
+EXTRACT_SYSTEM_PROMPT = """
 Je bent een CV-analyse AI. Je taak is om ruwe tekst uit een PDF te converteren
 naar een gestructureerde JSON voor een CV-maker app.
 
@@ -372,131 +590,472 @@ Gebruik dit schema:
     "location": ""
   }
 }
+
+Regels:
+- Antwoord uitsluitend met geldige JSON volgens het schema, zonder uitleg en zonder ```-blokken.
+- Laat velden die niet in de tekst voorkomen leeg ("" of []); verzin geen gegevens.
+- Houd de taal van de bron aan; vertaal niets.
+- Zet perioden om naar de vorm "MM/JJJJ - MM/JJJJ" of "MM/JJJJ - heden" waar mogelijk.
+- Splits opsommingen onder een functie in losse "bullets", één prestatie of taak per item.
+- "skills" bevat alleen vaardigheden en tools; talen horen in "languages".
+- Een korte profieltekst bovenaan de CV hoort in "summary".
+- "title" is de huidige of gewenste functietitel, niet de naam van een opleiding.
+- Contactgegevens (telefoon, e-mail, woonplaats) horen in "contact"; laat links naar
+  sociale media weg tenzij ze nergens anders passen.
+- Nevenfuncties, vrijwilligerswerk en stages zijn gewone "experience"-items.
+
+Voorbeeld
+
+PDF-tekst:
+Sanne de Vries
+Senior Data Engineer
+Utrecht | +31 6 12345678 | sanne.devries@example.com
+
+Profiel
+Data engineer met acht jaar ervaring in het bouwen van schaalbare datapijplijnen
+voor de financiële sector en e-commerce. Sterk in het vertalen van businessvragen
+naar robuuste, goed geteste oplossingen.
+
+Werkervaring
+Senior Data Engineer - Bank Noord, Amsterdam (03/2020 - heden)
+• Ontwierp een streamingplatform op Kafka dat dagelijks 40 miljoen transacties verwerkt
+• Verlaagde de cloudkosten van het datawarehouse met 35% door partitionering en caching
+• Begeleidt een team van vier medior engineers
+
+Data Engineer - WebWinkel BV, Utrecht (09/2016 - 02/2020)
+• Bouwde ETL-processen in Python en Airflow voor voorraad- en verkoopdata
+• Introduceerde datakwaliteitscontroles die rapportagefouten met 60% verminderden
+
+Projecten
+Open Data Dashboard (2021): vrijwilligersproject dat gemeentelijke open data
+visualiseert voor bewonersinitiatieven.
+
+Opleiding
+MSc Computer Science - Universiteit Utrecht (2014 - 2016)
+BSc Informatica - Hogeschool Utrecht (2010 - 2014)
+
+Vaardigheden: Python, SQL, Kafka, Airflow, Spark, Terraform, AWS
+Talen: Nederlands (moedertaal), Engels (vloeiend), Duits (basis)
+Hobby's: wielrennen, fotografie
+
+JSON:
+{
+  "name": "Sanne de Vries",
+  "title": "Senior Data Engineer",
+  "summary": "Data engineer met acht jaar ervaring in het bouwen van schaalbare datapijplijnen voor de financiële sector en e-commerce. Sterk in het vertalen van businessvragen naar robuuste, goed geteste oplossingen.",
+  "experience": [
+    {
+      "role": "Senior Data Engineer",
+      "company": "Bank Noord, Amsterdam",
+      "period": "03/2020 - heden",
+      "bullets": [
+        "Ontwierp een streamingplatform op Kafka dat dagelijks 40 miljoen transacties verwerkt",
+        "Verlaagde de cloudkosten van het datawarehouse met 35% door partitionering en caching",
+        "Begeleidt een team van vier medior engineers"
+      ]
+    },
+    {
+      "role": "Data Engineer",
+      "company": "WebWinkel BV, Utrecht",
+      "period": "09/2016 - 02/2020",
+      "bullets": [
+        "Bouwde ETL-processen in Python en Airflow voor voorraad- en verkoopdata",
+        "Introduceerde datakwaliteitscontroles die rapportagefouten met 60% verminderden"
+      ]
+    }
+  ],
+  "projects": [
+    {
+      "name": "Open Data Dashboard",
+      "period": "2021",
+      "description": "Vrijwilligersproject dat gemeentelijke open data visualiseert voor bewonersinitiatieven."
+    }
+  ],
+  "education": [
+    {
+      "degree": "MSc Computer Science",
+      "school": "Universiteit Utrecht",
+      "period": "2014 - 2016"
+    },
+    {
+      "degree": "BSc Informatica",
+      "school": "Hogeschool Utrecht",
+      "period": "2010 - 2014"
+    }
+  ],
+  "skills": ["Python", "SQL", "Kafka", "Airflow", "Spark", "Terraform", "AWS"],
+  "languages": ["Nederlands (moedertaal)", "Engels (vloeiend)", "Duits (basis)"],
+  "hobbies": ["wielrennen", "fotografie"],
+  "contact": {
+    "phone": "+31 6 12345678",
+    "email": "sanne.devries@example.com",
+    "location": "Utrecht"
+  }
+}
 """
+
+
+def ai_extract_resume(pdf_text: str) -> Dict[str, Any]:
     user = f"Zet deze PDF-tekst om naar JSON:\n\n{pdf_text}"
-    raw = call_ai(system, user)
+    raw = call_ai(EXTRACT_SYSTEM_PROMPT, user)
     try:
-        return json.loads(raw)
+        return parse_ai_json(raw)
     except Exception:
         return {"error": "AI kon JSON niet parsen", "raw": raw}
 
 
-def ai_rewrite_text(text: str, instruction: str) -> str:
+async def ai_rewrite_text(text: str, instruction: str) -> str:
     system = "Je herschrijft tekst volgens instructies. Houd het professioneel en beknopt."
     user = f"Originele tekst:\n{text}\n\nInstructie:\n{instruction}"
-    return call_ai(system, user)
+    return await acall_ai(system, user)
 
 
-def ai_regenerate_field(field_name: str, resume: Resume) -> str:
+async def ai_regenerate_field(field_name: str, resume: Resume) -> str:
     system = "Je genereert professionele CV-tekst voor één veld."
     user = f"""
 Genereer het veld '{field_name}' opnieuw op basis van deze CV:
 
 {resume.to_json()}
 """
-    return call_ai(system, user)
+    return await acall_ai(system, user)
 
 
-def ai_generate_summary(resume: Resume) -> str:
+async def ai_batch_regenerate(fields: List[str], resume: Resume) -> Dict[str, Any]:
+    """
+    Regenerates several fields with a single AI call. Returns only the fields the
+    model actually produced; an empty dict means the answer was not usable JSON.
+    """
+    system = (
+        "Je genereert professionele CV-tekst voor meerdere velden tegelijk. "
+        "Antwoord uitsluitend met één JSON-object met precies één sleutel per gevraagd veld."
+    )
+    keys = ", ".join(f'"{f}"' for f in fields)
+    user = f"""
+Genereer de velden {keys} opnieuw op basis van deze CV:
+
+{resume.to_json()}
+"""
+    raw = await acall_ai(system, user)
+    try:
+        data = parse_ai_json(raw)
+    except Exception:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {k: data[k] for k in fields if k in data}
+
+
+async def ai_generate_summary(resume: Resume) -> str:
     system = "Je schrijft een krachtige professionele CV-samenvatting."
     user = f"Schrijf een samenvatting voor deze persoon:\n\n{resume.to_json()}"
-    return call_ai(system, user)
+    return await acall_ai(system, user)
 
 # -----------------------------
 # CLI
 # -----------------------------
 
+def coerce_resume_dict(d: Any, source: str) -> Any:
+    """
+    Loosens loosely typed resume data (e.g. files written before typed loading)
+    so it fits Resume: nulls are dropped, scalar contact values become strings,
+    and any field that still has the wrong type is reset to its default.
+    """
+    if not isinstance(d, dict):
+        return d
+    d = drop_nulls(d)
+    contact = d.get("contact")
+    if isinstance(contact, dict):
+        d["contact"] = {
+            k: str(v) if isinstance(v, (int, float, bool)) else v for k, v in contact.items()
+        }
+    for name, tp in RESUME_FIELD_TYPES.items():
+        if name not in d:
+            continue
+        try:
+            msgspec.convert(d[name], tp)
+        except msgspec.ValidationError as e:
+            print(c_yellow(f"{source}: field '{name}' ignored ({e}); using the default."))
+            del d[name]
+    return d
+
+
 def load_resume(path: str) -> Resume:
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return Resume.from_dict(data)
+    # Decoded straight into a Resume; field types are checked while parsing.
+    # Files that do not fit exactly take the slower, lenient dict path.
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        return msgspec.json.decode(data, type=Resume)
+    except msgspec.ValidationError:
+        return Resume.from_dict(coerce_resume_dict(load_json_bytes(data), path))
 
 
 def save_resume(resume: Resume, path: str):
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(resume.to_json())
+    with open(path, "wb") as f:
+        f.write(dump_json_bytes(resume))
 
 
 def cmd_render(args):
     r = load_resume(args.input)
-    html = render_template(r)
-    with open(args.output, "w", encoding="utf-8") as f:
-        f.write(html)
-    print(color(f"Rendered HTML written to {args.output}", "green"))
+    _select_template(r)  # unknown theme / missing jinja2: fail before touching any file
+    # Stream into a temp file next to the output and move it into place only
+    # once rendering succeeded, so a failure never leaves a truncated page.
+    tmp_path = f"{args.output}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            render_template_stream(r, f)
+        os.replace(tmp_path, args.output)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    print(c_green(f"Rendered HTML written to {args.output}"))
 
 
 def cmd_extract(args):
     # read plain text extracted from PDF (user provides)
     with open(args.input, "r", encoding="utf-8") as f:
         pdf_text = f.read()
-    print(color("Calling AI to extract structured resume...", "cyan"))
+    print(c_cyan("Calling AI to extract structured resume..."))
     result = ai_extract_resume(pdf_text)
     if "error" in result:
-        print(color("AI extraction failed or produced non-JSON output:", "red"))
+        print(c_red("AI extraction failed or produced non-JSON output:"))
         print(result.get("raw"))
         return
+    try:
+        resume = Resume.from_dict(result)
+    except msgspec.ValidationError as e:
+        print(c_red(f"AI extraction does not match the resume format: {e}"))
+        print_json(result)
+        return
     save_path = args.output or "resume_extracted.json"
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(result, f, indent=2, ensure_ascii=False)
-    print(color(f"Extracted resume saved to {save_path}", "green"))
+    save_resume(resume, save_path)
+    print(c_green(f"Extracted resume saved to {save_path}"))
 
 
 def cmd_set_photo(args):
     r = load_resume(args.resume)
-    with open(args.photo, "rb") as f:
-        b = f.read()
-    r.set_photo(b)
+    r.set_photo_path(args.photo)
     save_resume(r, args.resume)
-    print(color("Photo embedded into resume JSON.", "green"))
+    print(c_green("Photo embedded into resume JSON."))
 
 
 def cmd_summary(args):
+    import asyncio
+
     r = load_resume(args.resume)
-    print(color("Calling AI to generate a summary...", "cyan"))
-    s = ai_generate_summary(r)
+    print(c_cyan("Calling AI to generate a summary..."))
+    try:
+        s = asyncio.run(run_with_ai_client(ai_generate_summary(r)))
+    except AIError as e:
+        print(c_red(str(e)))
+        return
     print("--- AI SUMMARY ---")
     print(s)
     if args.save:
         r.summary = s
         save_resume(r, args.resume)
-        print(color("Saved AI summary into resume file.", "green"))
+        print(c_green("Saved AI summary into resume file."))
 
 
-def cmd_review(args):
-    r = load_resume(args.resume)
-    print(color("=== AI REVIEW WIZARD ===", "cyan"))
-    fields = ["summary", "experience", "projects", "education", "skills"]
+def set_ai_field(resume: Resume, field_name: str, value: Any) -> bool:
+    # Only store values that fit the field's type, so the saved file still decodes.
+    try:
+        value = msgspec.convert(value, RESUME_FIELD_TYPES[field_name])
+    except msgspec.ValidationError as e:
+        print(c_red(f"AI output for {field_name} not used ({e}); keeping the current value."))
+        return False
+    setattr(resume, field_name, value)
+    return True
+
+
+def apply_ai_value(resume: Resume, field_name: str, text: str) -> bool:
+    # Try to parse JSON, else set raw text
+    try:
+        parsed = parse_ai_json(text)
+    except Exception:
+        parsed = text
+    return set_ai_field(resume, field_name, parsed)
+
+
+async def regenerate_fields(resume: Resume, fields: List[str]) -> List[str]:
+    """
+    Regenerates fields with one batched call. Fields missing from a parsed answer
+    fall back to per-field calls; if the batch call itself fails (auth, network,
+    rate limit) every field counts as failed, without retrying each one.
+    Returns the fields whose AI call failed or whose answer did not fit the
+    field's type; those are left unchanged.
+    """
+    import asyncio
+
+    if not fields:
+        return []
+    try:
+        results = await ai_batch_regenerate(fields, resume)
+    except AIError as e:
+        print(c_red(f"{', '.join(fields)}: {e}"))
+        return list(fields)
+    missing = [f for f in fields if f not in results]
+    fallback = await asyncio.gather(
+        *(ai_regenerate_field(f, resume) for f in missing), return_exceptions=True
+    )
+    failed = []
+    for field in fields:
+        if field in results and not set_ai_field(resume, field, results[field]):
+            failed.append(field)
+    for field, text in zip(missing, fallback):
+        if isinstance(text, AIError):
+            print(c_red(f"{field}: {text}"))
+            failed.append(field)
+        elif isinstance(text, BaseException):
+            raise text
+        elif not apply_ai_value(resume, field, text):
+            failed.append(field)
+    return failed
+
+
+async def run_review_tasks(resume: Resume, tasks: List[tuple]) -> List[tuple]:
+    """
+    Runs the wizard's collected (field, choice, instruction) tasks concurrently:
+    all rewrites plus one batched regeneration, then applies the results.
+    Returns the tasks whose AI call failed or whose answer was rejected by type
+    validation; their fields are left unchanged.
+    """
+    import asyncio
+
+    rewrites = [(field, instruction) for field, choice, instruction in tasks if choice == "e"]
+    regenerate = [field for field, choice, _ in tasks if choice == "r"]
+    # Every AI call reads the resume as it was reviewed, before any result is applied.
+    snapshot = msgspec.structs.replace(resume)
+    rewritten, failed_regenerate = await asyncio.gather(
+        asyncio.gather(*(
+            ai_rewrite_text(dump_json(getattr(snapshot, field), indent=False), instruction)
+            for field, instruction in rewrites
+        ), return_exceptions=True),
+        regenerate_fields(snapshot, regenerate),
+    )
+    failed = []
+    for (field, instruction), new_text in zip(rewrites, rewritten):
+        if isinstance(new_text, AIError):
+            print(c_red(f"{field}: {new_text}"))
+            failed.append((field, "e", instruction))
+        elif isinstance(new_text, BaseException):
+            raise new_text
+        elif not apply_ai_value(resume, field, new_text):
+            failed.append((field, "e", instruction))
+    for field in regenerate:
+        if field in failed_regenerate:
+            failed.append((field, "r", None))
+        else:
+            setattr(resume, field, getattr(snapshot, field))
+    return failed
+
+
+def collect_review_tasks(resume: Resume, fields: List[str]) -> List[tuple]:
+    # All choices are asked up front, so no prompt waits on an AI call.
+    tasks = []
     for field in fields:
-        print(color(f"\n--- {field.upper()} ---", "yellow"))
-        val = getattr(r, field)
+        print(c_yellow(f"\n--- {field.upper()} ---"))
+        val = getattr(resume, field)
         print_json(val)
         print("Options: [a] Accept  [e] Edit (AI rewrite)  [r] Regenerate  [s] Skip")
         choice = input("Choice: ").strip().lower()
-        if choice == "a":
-            continue
-        elif choice == "e":
+        if choice == "e":
             instruction = input("Rewrite instruction: ")
-            new_text = ai_rewrite_text(json.dumps(val, ensure_ascii=False), instruction)
-            # Try to parse JSON, else set raw text
-            try:
-                parsed = json.loads(new_text)
-                setattr(r, field, parsed)
-            except Exception:
-                setattr(r, field, new_text)
+            tasks.append((field, choice, instruction))
         elif choice == "r":
-            regenerated = ai_regenerate_field(field, r)
-            try:
-                parsed = json.loads(regenerated)
-                setattr(r, field, parsed)
-            except Exception:
-                setattr(r, field, regenerated)
-        elif choice == "s":
-            continue
+            tasks.append((field, choice, None))
+    return tasks
+
+
+def cmd_review(args):
+    import asyncio
+
+    r = load_resume(args.resume)
+    print(c_cyan("=== AI REVIEW WIZARD ==="))
+    fields = ["summary", "experience", "projects", "education", "skills"]
+    # Collected tasks are written here before the AI calls fire. Afterwards only
+    # the failed tasks are kept (or the file is removed), so an interrupted or
+    # partly failed review can be picked up again.
+    pending_path = args.resume + ".review-pending.json"
+
+    tasks = None
+    if os.path.exists(pending_path) and not args.auto:
+        answer = input("Unfinished review found. Rerun its AI tasks? [y/N] ").strip().lower()
+        if answer == "y":
+            with open(pending_path, "rb") as f:
+                tasks = [tuple(t) for t in load_json_bytes(f.read())]
+    if tasks is None:
+        if args.auto:
+            tasks = [(field, "r", None) for field in fields]
+        else:
+            tasks = collect_review_tasks(r, fields)
+
+    if tasks:
+        with open(pending_path, "wb") as f:
+            f.write(dump_json_bytes(tasks))
+        print(c_cyan(f"\nCalling AI for {', '.join(field for field, _, _ in tasks)}..."))
+        failed = asyncio.run(run_with_ai_client(run_review_tasks(r, tasks)))
+    else:
+        failed = []
     save_resume(r, args.resume)
-    print(color("\n✅ AI Review voltooid! Geslagen naar bestand.", "green"))
+    if failed:
+        with open(pending_path, "wb") as f:
+            f.write(dump_json_bytes(failed))
+        print(c_yellow(f"\nAI failed for {', '.join(field for field, _, _ in failed)}; "
+                       "run review again to retry."))
+    else:
+        if os.path.exists(pending_path):
+            os.remove(pending_path)
+        print(c_green("\n✅ AI Review voltooid! Geslagen naar bestand."))
+
+
+# Command table for the argparse-free fast path in main():
+# name -> (handler, positional arg names, {flag: (dest, takes_value)})
+COMMANDS = {
+    "render": (cmd_render, ["input", "output"], {}),
+    "extract": (cmd_extract, ["input"], {"-o": ("output", True), "--output": ("output", True)}),
+    "set-photo": (cmd_set_photo, ["resume", "photo"], {}),
+    "summary": (cmd_summary, ["resume"], {"--save": ("save", False)}),
+    "review": (cmd_review, ["resume"], {"--auto": ("auto", False)}),
+}
 
 
-def main():
+def parse_command(argv: List[str]) -> Optional[SimpleNamespace]:
+    """
+    Parses the common invocations straight from COMMANDS. Returns None for anything
+    else (help, unknown command or flag, wrong argument count) so main() can hand
+    over to the full argparse parser, which prints the usage or error message.
+    """
+    if not argv or argv[0] not in COMMANDS:
+        return None
+    func, positional, flags = COMMANDS[argv[0]]
+    values = {dest: None if takes_value else False for dest, takes_value in flags.values()}
+    rest = []
+    it = iter(argv[1:])
+    for arg in it:
+        if arg in flags:
+            dest, takes_value = flags[arg]
+            if takes_value:
+                value = next(it, None)
+                if value is None:
+                    return None
+                values[dest] = value
+            else:
+                values[dest] = True
+        elif arg.startswith("-") and arg != "-":
+            return None
+        else:
+            rest.append(arg)
+    if len(rest) != len(positional):
+        return None
+    values.update(zip(positional, rest))
+    return SimpleNamespace(cmd=argv[0], func=func, **values)
+
+
+def build_parser():
+    import argparse
+
     parser = argparse.ArgumentParser(description="Resume CLI: render, extract and call AI helpers")
     sub = parser.add_subparsers(dest="cmd")
 
@@ -522,17 +1081,26 @@ def main():
 
     p_review = sub.add_parser("review", help="Interactive AI review wizard")
     p_review.add_argument("resume", help="resume JSON file")
+    p_review.add_argument("--auto", action="store_true", help="regenerate all fields in one AI call, no prompts")
     p_review.set_defaults(func=cmd_review)
 
-    args = parser.parse_args()
-    if not args.cmd:
-        parser.print_help()
-        sys.exit(1)
+    return parser
+
+
+def main():
+    # argparse is only imported and built when the fast path cannot handle argv.
+    args = parse_command(sys.argv[1:])
+    if args is None:
+        parser = build_parser()
+        args = parser.parse_args()
+        if not args.cmd:
+            parser.print_help()
+            sys.exit(1)
 
     try:
         args.func(args)
     except Exception as e:
-        print(color(f"Error: {e}", "red"))
+        print(c_red(f"Error: {e}"))
         sys.exit(2)
 
 